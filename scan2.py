@@ -5,16 +5,22 @@ A python script to enumerate wayland protocol requests and events as zig source
 code.
 """
 
-from itertools import groupby
-from math import log2
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import cache, partial
+from os.path import commonprefix
 from pathlib import Path
-from re import match
+import re
 from subprocess import check_output
-from sys import argv, stderr
-from typing import Iterable
-from xml.etree import ElementTree as xml
+from sys import argv, intern, stderr
+from typing import Callable, Iterable, Mapping
 
-trees: Iterable[xml.ElementTree] = []
+try:
+    from lxml import etree as xml
+except ImportError:
+    from xml.etree import ElementTree as xml
 
 type_mapping = {
     "array": "types.Array",
@@ -30,7 +36,7 @@ deprecated_interfaces = [
     "wl_shell", "wl_shell_surface",
 ]
 
-disallowed_words = {
+disallowed_words = frozenset({
     "addrspace",   "align",          "allowzero",   "and",
     "anyframe",    "anytype",        "asm",         "async",
     "await",       "break",          "callconv",    "catch",
@@ -44,7 +50,7 @@ disallowed_words = {
     "test",        "threadlocal",    "try",         "union",
     "unreachable", "usingnamespace", "var",         "volatile",
     "while",
-}.union({
+}).union({
     "isize",    "usize",      "c_char",      "c_short",
     "c_ushort", "c_int",      "c_uint",      "c_long",
     "c_ulong",  "c_longlong", "c_ulonglong", "c_longdouble",
@@ -57,260 +63,408 @@ disallowed_words = {
     "null", "undefined",
 })
 
+# integer type names such as u8 or i32, and anything not starting with a letter
+disallowed_pattern = re.compile(r'^[iu][0-9]+$|^[^a-zA-Z]')
+
+# protocol file name components dropped when matching unstable to stable
+unneeded_pattern = re.compile(r'^(?:unstable|v[0-9]+)$')
+
+@dataclass(slots=True, eq=False)
+class Entry:
+    name: str
+    value: str
+
+@dataclass(slots=True, eq=False)
+class Enum:
+    name: str
+    bitfield: bool
+    entries: list[Entry] = field(default_factory=list)
+
+@dataclass(slots=True, eq=False)
+class Argument:
+    name: str
+    type: str
+    enum: str | None
+    interface: str | None
+    zig: list[str] = field(default_factory=list)
+
+@dataclass(slots=True, eq=False)
+class Method:
+    name: str
+    args: list[Argument] = field(default_factory=list)
+
+@dataclass(slots=True, eq=False)
+class Interface:
+    name: str
+    requests: list[Method] = field(default_factory=list)
+    events: list[Method] = field(default_factory=list)
+    enums: list[Enum] = field(default_factory=list)
+
+@dataclass(slots=True, eq=False)
+class Protocol:
+    name: str
+    copyright: list[str] = field(default_factory=list)
+    interfaces: list[Interface] = field(default_factory=list)
+
+Named = Interface | Method | Argument | Enum | Entry
+
 def isAllowed(word: str) -> bool:
     if word in disallowed_words:
         return False
-    if match('^[iu][0-9]+$', word):
-        return False
-    if match('^[^a-zA-Z]', word):
+    if disallowed_pattern.match(word):
         return False
     return True
 
-def getNamespace(tree: xml.ElementTree) -> str:
-    if next(tree.iter('interface'), None) is None:
-        return ''
+@cache
+def getPrefix(protocol: Protocol) -> str:
+    if not protocol.interfaces:
+        return '_'
 
-    for i, letters in enumerate(zip(*(i.attrib['name'] for i in tree.iter('interface')))):
-        if len(set(letters)) > 1:
-            return next(tree.iter('interface')).attrib['name'][:i].split('_')[0]
-    return min(tree.iter('interface'), key=lambda i: len(i.attrib['name'])).attrib['name'].split('_')[0]
+    namespace = commonprefix([interface.name for interface in protocol.interfaces]).split('_')[0]
+    return f'{namespace}_'
 
-def getEvent(interface: xml.Element, tree: xml.ElementTree) -> str:
-    file = tree.getroot().attrib['name']
-    return f'{file}.{rename(interface, tree)}.event'
+def getEvent(interface: Interface, protocol: Protocol) -> str:
+    file = protocol.name
+    return f'{file}.{rename(interface, protocol)}.event'
 
-def rename(element: xml.Element, tree: xml.ElementTree) -> str:
-    cut = element.attrib['name'].removeprefix(f'{getNamespace(tree)}_')
+@cache
+def rename(element: Named, protocol: Protocol) -> str:
+    prefix = getPrefix(protocol)
+    cut = element.name.removeprefix(prefix)
     if not isAllowed(cut):
-        return f'{getNamespace(tree)}_{cut}'
+        return prefix + cut
     return cut
 
+@cache
 def renameEnum(name: str) -> str:
-    return ''.join(word.title() for word in name.split('_'))
+    return ''.join([word.title() for word in name.split('_')])
 
 def zigFormat(source: str) -> str:
     return check_output(['zig', 'fmt', '--stdin'], input=source, text=True)
 
-def genImportAll(tree: Iterable[xml.ElementTree]) -> str:
-    return '\n'.join(
-        f'pub const {protocol.attrib['name']} = @import("{protocol.attrib['name']}.zig");'
-        for tree in tree
-        for protocol in tree.iter('protocol')
+def zigFormatAll(directory: Path) -> None:
+    check_output(['zig', 'fmt', str(directory)])
+
+def tidyLines(lines: list[str]) -> list[str]:
+    tidy: list[str] = []
+    for line in lines:
+        if line or (tidy and tidy[-1]):
+            tidy.append(line)
+    while tidy and not tidy[-1]:
+        tidy.pop()
+    return tidy
+
+def genBlock(out: list[str], indent: str, head: str, lines: list[str], tail: str) -> None:
+    lines = tidyLines(lines)
+    if not lines:
+        out.append(f'{indent}{head}}}{tail}\n')
+        return
+    out.append(f'{indent}{head}\n')
+    for line in lines:
+        out.append(f'{indent}    {line}\n' if line else '\n')
+    out.append(f'{indent}}}{tail}\n')
+
+def genEventHandlers(out: list[str], name: str, event: str) -> None:
+    out.append(f'    {name}: std.EnumArray(\n')
+    out.append(f'        {event},\n')
+    out.append('        ?struct {\n')
+    out.append('            context: *anyopaque,\n')
+    out.append(f'            call: *const fn (*anyopaque, u32, {event}, []const u8) void,\n')
+    out.append('        },\n')
+    out.append('    ),\n')
+
+def genProtoZig(protocols: Iterable[Protocol]) -> str:
+    # fill every section in a single pass over the interfaces
+    imports: list[str] = []
+    interfaces = ['    invalid,\n']
+    maps = ['    .invalid = enum {},\n']
+    events: list[str] = []
+    genEventHandlers(events, 'invalid', 'enum {}')
+    for protocol in protocols:
+        name = protocol.name
+        imports.append(f'pub const {name} = @import("{name}.zig");\n')
+        for interface in protocol.interfaces:
+            event = getEvent(interface, protocol)
+            interfaces.append(f'    {interface.name},\n')
+            maps.append(f'    .{interface.name} = {event},\n')
+            genEventHandlers(events, interface.name, event)
+
+    out: list[str] = []
+    out.append('pub const std = @import("std");\n')
+    out.append('\n')
+    if imports:
+        out.extend(imports)
+        out.append('\n')
+    out.append('pub const types = @import("types.zig");\n')
+    out.append('\n')
+    out.append('pub const Interface = enum {\n')
+    out.extend(interfaces)
+    out.append('};\n')
+    out.append('\n')
+    out.append('pub const map = std.EnumArray(Interface, type).init(.{\n')
+    out.extend(maps)
+    out.append('});\n')
+    out.append('\n')
+    out.append('pub const Events = union(Interface) {\n')
+    out.extend(events)
+    out.append('};\n')
+    return ''.join(out)
+
+def genTypesZig() -> str:
+    return (
+        'pub const String = []const u8;\n'
+        'pub const Array = []const u32;\n'
     )
 
-def genInterfaceEnum(trees: Iterable[xml.ElementTree]) -> str:
-    return zigFormat(f"""pub const Interface = enum {{
-        invalid,
-        { '\n'.join(
-            f'{interface.attrib['name']},'
-            for tree in trees
-            for interface in tree.iter('interface')
-        ) }
-    }};""")
-
-def genMap(trees: Iterable[xml.ElementTree]) -> str:
-    return f"""
-    pub const map = std.EnumArray(Interface, type).init(.{{
-        .invalid = enum {{}},
-        { '\n'.join(
-            f'.{interface.attrib['name']} = {getEvent(interface, tree)},'
-            for tree in trees
-            for interface in tree.iter('interface')
-        ) }
-    }});
-    """
-
-def genEvents(trees: Iterable[xml.ElementTree]) -> str:
-    return f"""
-    pub const Events = union(Interface) {{
-        invalid: std.EnumArray(enum {{}}, ?struct {{ context: *anyopaque, call: *const fn (*anyopaque, u32, enum {{}}, []const u8) void, }},),
-        { '\n'.join(
-            f"""{interface.attrib['name']}: std.EnumArray(
-                {getEvent(interface, tree)},
-                ?struct {{
-                    context: *anyopaque,
-                    call: *const fn (*anyopaque, u32, {getEvent(interface, tree)}, []const u8) void,
-                }},
-            ),"""
-            for tree in trees
-            for interface in tree.iter('interface')
-        ) }
-    }};
-    """
-
-def genProtoZig(protocols: Iterable[xml.ElementTree]) -> str:
-    return zigFormat(f"""
-        pub const std = @import("std");
-
-        {genImportAll(protocols)}
-
-        pub const types = @import("types.zig");
-
-        {genInterfaceEnum(protocols)}
-        {genMap(protocols)}
-        {genEvents(protocols)}
-    """)
+EnumDefinition = tuple[str, str]
+EnumIndex = dict[tuple[str, str], list[EnumDefinition]]
 
-def genTypesZig() -> str:
-    return zigFormat(f"""
-        pub const String = []const u8;
-        pub const Array = []const u32;
-    """)
+def indexEnums(protocols: Iterable[Protocol]) -> EnumIndex:
+    index: EnumIndex = {}
+    for protocol in protocols:
+        for interface in protocol.interfaces:
+            for enum in interface.enums:
+                key = (interface.name, enum.name)
+                index.setdefault(key, []).append((protocol.name, rename(interface, protocol)))
+    return index
 
 def findEnumDefinition(
     definition: str,
-    current_interface: xml.Element,
-    current_tree: xml.ElementTree
-) -> tuple[xml.ElementTree | None, xml.Element | None, xml.Element]:
-    try:
-        if '.' not in definition:
-            return next(
-                (None, None, enum)
-                for enum in current_interface.iter('enum')
-                if enum.attrib['name'] == definition
-            )
-
+    current_interface: Interface,
+    current_protocol: Protocol,
+    enum_index: EnumIndex,
+) -> tuple[str | None, str | None, str]:
+    current_name = current_protocol.name
+    if '.' not in definition:
+        key = (current_interface.name, definition)
+        if any(name == current_name for name, _ in enum_index.get(key, [])):
+            return None, None, definition
+    else:
         interface_name, enum_name = definition.split('.')
-        try:
-            return next(
-                (None, interface, enum)
-                for interface in current_tree.iter('interface')
-                if interface.attrib['name'] == interface_name
-                for enum in interface.iter('enum')
-                if enum.attrib['name'] == enum_name
-            )
-        except StopIteration:
-            return next(
-                (tree, interface, enum)
-                for tree in trees
-                for interface in tree.iter('interface')
-                if interface.attrib['name'] == interface_name
-                for enum in interface.iter('enum')
-                if enum.attrib['name'] == enum_name
-            )
-    except StopIteration:
-        print(f"scan2.py: fatal: Unable to find definition for {definition}", file=stderr)
-        exit(1)
-
-def genSingleArgument(argument: xml.Element, interface: xml.Element, tree: xml.ElementTree) -> str:
-    if argument.attrib['type'] == "fd":
-        return ''
-
-    if argument.attrib['type'] == "uint" and 'enum' in argument.attrib:
-        enum_tree, enum_interface, enum = findEnumDefinition(argument.attrib['enum'], interface, tree)
-        tree_decl = f'@import("{enum_tree.getroot().attrib['name']}.zig").' if enum_tree is not None else ''
-        interface_decl = f'{rename(enum_interface, enum_tree or tree)}.' if enum_interface is not None else ''
-        return f"{rename(argument, tree)}: {tree_decl}{interface_decl}{renameEnum(enum.attrib['name'])},"
-
-    if argument.attrib['type'] == "new_id" and "interface" not in argument.attrib:
-        return f"""
-            interface: {type_mapping['string']},
-            version: {type_mapping['uint']},
-            {rename(argument, tree)}: {type_mapping[argument.attrib['type']]},
-        """
-
-    return f"{rename(argument, tree)}: {type_mapping[argument.attrib['type']]},"
-
-def genSingleRequest(request: xml.Element, interface: xml.Element, tree: xml.ElementTree) -> str:
-    return f"""
-        {rename(request, tree)}: struct {{
-            { '\n'.join(
-                genSingleArgument(argument, interface, tree)
-                for argument in request.iter('arg')
-            ) }
-        }},
-    """
-
-def genSingleEvent(event: xml.Element, interface: xml.Element, tree: xml.ElementTree) -> str:
-    return f"""
-        pub const {rename(event, tree)} = struct {{
-            { '\n'.join(
-                genSingleArgument(argument, interface, tree)
-                for argument in event.iter('arg')
-            ) }
-        }};
-    """
-
-def genSingleBitfield(bitfield: xml.Element, tree: xml.ElementTree) -> str:
-    return f"""
-        pub const {renameEnum(bitfield.attrib['name'])} = packed struct(u32) {{
-            { '\n'.join(
-                f'{name}: bool,' if name != '_' else f'_: u{sum(1 for _ in group)},'
-                for name, group in groupby(next((
-                    rename(entry, tree)
-                    for entry in bitfield.iter('entry')
-                    if int(entry.attrib['value'], 0) > 0 and
-                        log2(int(entry.attrib['value'], 0)) == i
-                ), '_') for i in range(32))
-            ) }
-        }};
-    """
-
-def genSingleEnum(enum: xml.Element, tree: xml.ElementTree) -> str:
-    if 'bitfield' in enum.attrib and enum.attrib['bitfield'] == 'true':
-        return genSingleBitfield(enum, tree)
-    return f"""
-        pub const {renameEnum(enum.attrib['name'])} = enum (u32) {{
-            { '\n'.join(
-                f'{rename(entry, tree)} = {entry.attrib['value']},'
-                for entry in enum.iter('entry')
-            ) }
-        }};
-    """
-
-def genSingleInterface(interface: xml.Element, tree: xml.ElementTree) -> str:
-    return f"""
-        pub const {rename(interface, tree)} = struct {{
-            pub const request = enum {{
-                {'\n'.join(
-                    f'{rename(request, tree)},'
-                    for request in interface.iter('request')
-                )}
-            }};
-
-            pub const event = enum {{
-                {'\n'.join(
-                    f'{rename(event, tree)},'
-                    for event in interface.iter('event')
-                )}
-            }};
-
-            pub const rq = union(request) {{
-                { '\n'.join(
-                    genSingleRequest(request, interface, tree)
-                    for request in interface.iter('request')
-                ) }
-            }};
-
-            pub const ev = struct {{
-                { '\n'.join(
-                    genSingleEvent(event, interface, tree)
-                    for event in interface.iter('event')
-                ) }
-            }};
-
-            { '\n'.join(
-                genSingleEnum(enum, tree)
-                for enum in interface.iter('enum')
-            ) }
-        }};
-    """
-
-def genSingleZig(tree: xml.ElementTree) -> str:
-    return zigFormat(f"""
-        { '\n'.join(
-            f'// {line.strip()}'.strip()
-            for e in tree.iter('copyright') if e.text
-            for line in e.text.split('\n')
-        ) }
-
-        const types = @import("types.zig");
-
-        { '\n'.join(
-            genSingleInterface(interface, tree)
-            for interface in tree.iter('interface')
-        ) }
-    """)
+        candidates = enum_index.get((interface_name, enum_name), [])
+        for name, interface in candidates:
+            if name == current_name:
+                return None, interface, enum_name
+        if candidates:
+            name, interface = candidates[0]
+            return name, interface, enum_name
+
+    print(f"scan2.py: fatal: Unable to find definition for {definition}", file=stderr)
+    exit(1)
+
+def genSingleArgument(argument: Argument, interface: Interface, protocol: Protocol, enum_index: EnumIndex) -> list[str]:
+    if argument.type == "fd":
+        return ['']
+
+    if argument.type == "uint" and argument.enum is not None:
+        enum_protocol, enum_interface, enum = findEnumDefinition(argument.enum, interface, protocol, enum_index)
+        protocol_decl = f'@import("{enum_protocol}.zig").' if enum_protocol is not None else ''
+        interface_decl = f'{enum_interface}.' if enum_interface is not None else ''
+        return [f"{rename(argument, protocol)}: {protocol_decl}{interface_decl}{renameEnum(enum)},"]
+
+    if argument.type == "new_id" and argument.interface is None:
+        return [
+            '',
+            f"interface: {type_mapping['string']},",
+            f"version: {type_mapping['uint']},",
+            f"{rename(argument, protocol)}: {type_mapping[argument.type]},",
+            '',
+        ]
+
+    return [f"{rename(argument, protocol)}: {type_mapping[argument.type]},"]
+
+def resolveArguments(protocol: Protocol, enum_index: EnumIndex) -> None:
+    for interface in protocol.interfaces:
+        for methods in (interface.requests, interface.events):
+            for method in methods:
+                for argument in method.args:
+                    argument.zig = genSingleArgument(argument, interface, protocol, enum_index)
+
+def genArguments(method: Method) -> list[str]:
+    return [line for argument in method.args for line in argument.zig]
+
+def genSingleRequest(out: list[str], request: Method, protocol: Protocol) -> None:
+    lines = genArguments(request)
+    genBlock(out, '        ', f'{rename(request, protocol)}: struct {{', lines, ',')
+
+def genSingleEvent(out: list[str], event: Method, protocol: Protocol) -> None:
+    lines = genArguments(event)
+    genBlock(out, '        ', f'pub const {rename(event, protocol)} = struct {{', lines, ';')
+
+def genSingleBitfield(out: list[str], bitfield: Enum, protocol: Protocol) -> None:
+    named = 0
+    names: dict[int, str] = {}
+    for entry in bitfield.entries:
+        value = int(entry.value, 0)
+        if 0 < value < 1 << 32 and value & (value - 1) == 0 and not named & value:
+            named |= value
+            names[value.bit_length() - 1] = rename(entry, protocol)
+
+    lines: list[str] = []
+    bit = 0
+    while bit < 32:
+        if named >> bit & 1:
+            lines.append(f'{names[bit]}: bool,')
+            bit += 1
+            continue
+        # pad up to the next named bit, or to the end of the u32
+        rest = named >> bit
+        padding = (rest & -rest).bit_length() - 1 if rest else 32 - bit
+        lines.append(f'_: u{padding},')
+        bit += padding
+    genBlock(out, '    ', f'pub const {renameEnum(bitfield.name)} = packed struct(u32) {{', lines, ';')
+
+def genSingleEnum(out: list[str], enum: Enum, protocol: Protocol) -> None:
+    if enum.bitfield:
+        genSingleBitfield(out, enum, protocol)
+        return
+    lines = [
+        f'{rename(entry, protocol)} = {entry.value},'
+        for entry in enum.entries
+    ]
+    genBlock(out, '    ', f'pub const {renameEnum(enum.name)} = enum(u32) {{', lines, ';')
+
+def genSingleInterface(out: list[str], interface: Interface, protocol: Protocol) -> None:
+    requests = interface.requests
+    events = interface.events
+
+    out.append(f'pub const {rename(interface, protocol)} = struct {{\n')
+    genBlock(out, '    ', 'pub const request = enum {', [f'{rename(request, protocol)},' for request in requests], ';')
+    out.append('\n')
+    genBlock(out, '    ', 'pub const event = enum {', [f'{rename(event, protocol)},' for event in events], ';')
+    out.append('\n')
+
+    if not requests:
+        out.append('    pub const rq = union(request) {};\n')
+    else:
+        out.append('    pub const rq = union(request) {\n')
+        for i, request in enumerate(requests):
+            if i:
+                out.append('\n')
+            genSingleRequest(out, request, protocol)
+        out.append('    };\n')
+    out.append('\n')
+
+    if not events:
+        out.append('    pub const ev = struct {};\n')
+    else:
+        out.append('    pub const ev = struct {\n')
+        for i, event in enumerate(events):
+            if i:
+                out.append('\n')
+            genSingleEvent(out, event, protocol)
+        out.append('    };\n')
+
+    for enum in interface.enums:
+        out.append('\n')
+        genSingleEnum(out, enum, protocol)
+    out.append('};\n')
+
+def genSingleZig(protocol: Protocol, enum_index: EnumIndex) -> str:
+    resolveArguments(protocol, enum_index)
+
+    out: list[str] = []
+    for text in protocol.copyright:
+        if text:
+            for line in text.split('\n'):
+                comment = f'// {line.strip()}'.strip()
+                out.append(f'{comment}\n')
+    if out:
+        out.append('\n')
+    out.append('const types = @import("types.zig");\n')
+    for interface in protocol.interfaces:
+        out.append('\n')
+        genSingleInterface(out, interface, protocol)
+    return ''.join(out)
+
+class ProtocolBuilder:
+    """ Parser target collecting only the parts of a protocol used above """
+
+    # the innermost open element of each kind, set before any children
+    interface: Interface
+    method: Method
+    enum: Enum
+
+    def __init__(self) -> None:
+        self.tags: list[str] = []
+        self.protocol: Protocol | None = None
+        self.handlers: dict[tuple[str | None, str], Callable[[Mapping[str, str]], None]] = {
+            (None, 'protocol'): self.startProtocol,
+            ('protocol', 'copyright'): self.startCopyright,
+            ('protocol', 'interface'): self.startInterface,
+            ('interface', 'request'): self.startRequest,
+            ('interface', 'event'): self.startEvent,
+            ('interface', 'enum'): self.startEnum,
+            ('request', 'arg'): self.startArgument,
+            ('event', 'arg'): self.startArgument,
+            ('enum', 'entry'): self.startEntry,
+        }
+
+    def start(self, tag: str, attrib: Mapping[str, str]) -> None:
+        parent = self.tags[-1] if self.tags else None
+        self.tags.append(tag)
+        handler = self.handlers.get((parent, tag))
+        if handler is not None and (parent is None or self.protocol is not None):
+            handler(attrib)
+
+    def startProtocol(self, attrib: Mapping[str, str]) -> None:
+        self.protocol = Protocol(attrib['name'])
+
+    def startCopyright(self, attrib: Mapping[str, str]) -> None:
+        assert self.protocol is not None
+        self.protocol.copyright.append('')
+
+    def startInterface(self, attrib: Mapping[str, str]) -> None:
+        assert self.protocol is not None
+        self.interface = Interface(attrib['name'])
+        self.protocol.interfaces.append(self.interface)
+
+    def startRequest(self, attrib: Mapping[str, str]) -> None:
+        self.method = Method(attrib['name'])
+        self.interface.requests.append(self.method)
+
+    def startEvent(self, attrib: Mapping[str, str]) -> None:
+        self.method = Method(attrib['name'])
+        self.interface.events.append(self.method)
+
+    def startEnum(self, attrib: Mapping[str, str]) -> None:
+        self.enum = Enum(attrib['name'], attrib.get('bitfield') == 'true')
+        self.interface.enums.append(self.enum)
+
+    def startArgument(self, attrib: Mapping[str, str]) -> None:
+        self.method.args.append(Argument(
+            attrib['name'],
+            intern(attrib['type']),
+            attrib.get('enum'),
+            attrib.get('interface'),
+        ))
+
+    def startEntry(self, attrib: Mapping[str, str]) -> None:
+        self.enum.entries.append(Entry(attrib['name'], attrib['value']))
+
+    def end(self, tag: str) -> None:
+        self.tags.pop()
+
+    def data(self, data: str) -> None:
+        if self.protocol is not None and self.tags[-1] == 'copyright':
+            self.protocol.copyright[-1] += data
+
+    def close(self) -> Protocol | None:
+        return self.protocol
+
+def parseProtocol(file: Path) -> Protocol | None:
+    parser = xml.XMLParser(target=ProtocolBuilder())
+    parser.feed(file.read_bytes())
+    protocol: Protocol | None = parser.close()
+    return protocol
+
+def genFile(file: Path, enum_index: EnumIndex) -> tuple[str, str]:
+    protocol = parseProtocol(file)
+    assert protocol is not None
+    return protocol.name, genSingleZig(protocol, enum_index)
+
+def filterName(name: str) -> str:
+    return '-'.join([part for part in name.split('-') if not unneeded_pattern.match(part)])
 
 def find_protocols(search: Path) -> list[Path]:
     core = list(search.glob("wayland.xml"))
@@ -318,31 +472,35 @@ def find_protocols(search: Path) -> list[Path]:
     staging = list(search.glob("staging/**/*.xml"))
     unstable = list(search.glob("unstable/**/*.xml"))
     # filter out stable protocols
-    def hasStableVersion(f: Path) -> bool:
-        unneeded = lambda part: match('^(unstable)|(v[0-9]+)$', part)
-        filtername = lambda name: '-'.join(part for part in name.split('-') if not unneeded(part))
-        return filtername(f.stem) in (filtername(s.stem) for s in stable)
-    unstable = [f for f in unstable if not hasStableVersion(f)]
+    stable_names = {filterName(f.stem) for f in stable}
+    unstable = [f for f in unstable if filterName(f.stem) not in stable_names]
     return core + stable + unstable + staging
 
-def main(output, args):
+def main(output: str, args: list[str], format_output: bool = False) -> None:
     files = [p for path in args for p in find_protocols(Path(path))]
 
     destination = Path(output)
     destination.mkdir(parents=True, exist_ok=True)
 
-    global trees
-    trees = [xml.parse(file) for file in files]
-    trees = [tree for tree in trees if tree.getroot().tag == 'protocol']
+    parsed = [(file, parseProtocol(file)) for file in files]
+    files = [file for file, protocol in parsed if protocol is not None]
+    protocols = [protocol for _, protocol in parsed if protocol is not None]
+    for protocol in protocols:
+        getPrefix(protocol)
+
+    enum_index = indexEnums(protocols)
+
+    (destination / 'types.zig').write_bytes(genTypesZig().encode())
+    (destination / 'proto.zig').write_bytes(genProtoZig(protocols).encode())
 
-    with open(destination / 'types.zig', 'w') as f:
-        f.write(genTypesZig())
-    with open(destination / 'proto.zig', 'w') as f:
-        f.write(genProtoZig(trees))
+    with ProcessPoolExecutor() as executor:
+        for name, source in executor.map(partial(genFile, enum_index=enum_index), files):
+            (destination / f'{name}.zig').write_bytes(source.encode())
 
-    for tree in trees:
-        with open(destination / f'{tree.getroot().attrib['name']}.zig', 'w') as f:
-            f.write(genSingleZig(tree))
+    # the generated code is already laid out the way zig fmt would
+    if format_output:
+        zigFormatAll(destination)
 
 if __name__ == "__main__":
-    main(argv[1], argv[2:])
+    args = [arg for arg in argv[1:] if arg != '--format']
+    main(args[0], args[1:], '--format' in argv[1:])